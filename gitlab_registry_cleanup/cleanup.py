@@ -1,6 +1,12 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from .registry import LocalRegistry, DEFAULT_REGISTRY_ROOT
 from gitlab_registry_usage import GitLabRegistry, AuthTokenError, ImageDeleteError
-from typing import Callable, Optional
+from typing import Callable, List, Optional  # noqa: F401 pylint: disable=unused-import
+
+DEFAULT_MAX_WORKERS = 16
+DEFAULT_CONCURRENCY = 64
 
 
 def soft_delete_untagged_imagehashes(
@@ -11,18 +17,83 @@ def soft_delete_untagged_imagehashes(
     local_registry_root: str = DEFAULT_REGISTRY_ROOT,
     dry_run: bool = False,
     notify_callback: Optional[Callable[[str, str, bool], None]] = None,
+    max_workers: int = DEFAULT_MAX_WORKERS,
 ) -> None:
     local_registry = LocalRegistry(local_registry_root)
-    gitlab_registry = GitLabRegistry(gitlab_url, registry_url, admin_username, admin_auth_token)
-    repositories = sorted(local_registry.repository_paths)
-    for repository in repositories:
-        untagged_imagehashes = local_registry.repository_untagged_imagehashes[repository]
-        for untagged_imagehash in untagged_imagehashes:
-            try:
-                if not dry_run:
-                    gitlab_registry.delete_image(repository, untagged_imagehash)
-                successful = True
-            except (AuthTokenError, ImageDeleteError):
-                successful = False
+    if not dry_run:
+        gitlab_registry = GitLabRegistry(gitlab_url, registry_url, admin_username, admin_auth_token)
+    notify_lock = threading.Lock()
+
+    def delete_image(repository: str, untagged_imagehash: str) -> None:
+        try:
+            if not dry_run:
+                gitlab_registry.delete_image(repository, untagged_imagehash)
+            successful = True
+        except (AuthTokenError, ImageDeleteError):
+            successful = False
+        if notify_callback is not None:
+            with notify_lock:
+                notify_callback(repository, untagged_imagehash, successful)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # Stream untagged hashes repository by repository, so filesystem scanning and
+        # delete requests overlap and no registry-wide hash list is kept in memory
+        futures = [
+            executor.submit(delete_image, repository, untagged_imagehash)
+            for repository, untagged_imagehashes in local_registry.iter_untagged()
+            for untagged_imagehash in untagged_imagehashes
+        ]
+        for future in as_completed(futures):
+            future.result()
+
+
+async def soft_delete_untagged_imagehashes_async(
+    gitlab_url: str,
+    registry_url: str,
+    admin_username: str,
+    admin_auth_token: str,
+    local_registry_root: str = DEFAULT_REGISTRY_ROOT,
+    dry_run: bool = False,
+    notify_callback: Optional[Callable[[str, str, bool], None]] = None,
+    concurrency: int = DEFAULT_CONCURRENCY,
+) -> None:
+    # Transitional asyncio variant: gitlab_registry_usage only offers a synchronous
+    # delete_image, so the calls are dispatched to an executor and throttled with a
+    # semaphore; switch to a native async HTTP client once the library exposes one
+    local_registry = LocalRegistry(local_registry_root)
+    if not dry_run:
+        gitlab_registry = GitLabRegistry(gitlab_url, registry_url, admin_username, admin_auth_token)
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    def delete_image_blocking(repository: str, untagged_imagehash: str) -> bool:
+        try:
+            if not dry_run:
+                gitlab_registry.delete_image(repository, untagged_imagehash)
+            return True
+        except (AuthTokenError, ImageDeleteError):
+            return False
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+
+        async def delete_image(repository: str, untagged_imagehash: str) -> None:
+            async with semaphore:
+                successful = await loop.run_in_executor(
+                    executor, delete_image_blocking, repository, untagged_imagehash
+                )
             if notify_callback is not None:
                 notify_callback(repository, untagged_imagehash, successful)
+
+        delete_tasks = []  # type: List[asyncio.Task]
+        untagged_iterator = local_registry.iter_untagged()
+        while True:
+            # Pull the blocking generator in the executor so running delete tasks are not
+            # stalled while the next repository is scanned
+            untagged_record = await loop.run_in_executor(executor, next, untagged_iterator, None)
+            if untagged_record is None:
+                break
+            repository, untagged_imagehashes = untagged_record
+            for untagged_imagehash in untagged_imagehashes:
+                delete_tasks.append(asyncio.ensure_future(delete_image(repository, untagged_imagehash)))
+        if delete_tasks:
+            await asyncio.gather(*delete_tasks)
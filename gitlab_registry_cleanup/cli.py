@@ -1,13 +1,18 @@
 #!/usr/bin/env python3
 
 import argparse
+import asyncio
 import getpass
 import os
 import re
 import subprocess
 import sys
-from typing import cast, Any, Callable
-from .cleanup import soft_delete_untagged_imagehashes
+from typing import cast, Callable, Optional
+from .cleanup import (
+    soft_delete_untagged_imagehashes,
+    soft_delete_untagged_imagehashes_async,
+    DEFAULT_MAX_WORKERS,
+)
 from .registry import DEFAULT_REGISTRY_ROOT
 from ._version import __version__, __version_info__  # noqa: F401 pylint: disable=unused-import
 
@@ -18,6 +23,17 @@ __license__ = "MIT"
 
 DEFAULT_ORDER = "name"
 DEFAULT_USER = "root"
+# Keyed by (dry_run, successful)
+CONSOLE_OUTPUT_MESSAGE_TEMPLATES = {
+    (False, True): "Deleted image {blue}{image_hash}{reset} in repository {cyan}{repository}{reset}.",
+    (False, False): "Could not delete image {blue}{image_hash}{reset} in repository {cyan}{repository}{reset}.",
+    (True, True): "Would delete image {blue}{image_hash}{reset} in repository {cyan}{repository}{reset}.",
+    (True, False): (
+        "Would delete image {blue}{image_hash}{reset} in repository {cyan}{repository}{reset} "
+        "{red}but without success{reset}."
+    ),
+}
+SERVER_NAME_REGEX = re.compile(r"^([a-zA-Z]+://)?([^/]+)/?$")
 
 
 class MissingServerNameError(Exception):
@@ -47,33 +63,31 @@ def has_terminal_color() -> bool:
         return False
 
 
-class TerminalColorCodes:
-    if has_terminal_color():
-        RED = "\033[31;1m"
-        GREEN = "\033[32;1m"
-        YELLOW = "\033[33;1m"
-        BLUE = "\033[34;1m"
-        PURPLE = "\033[35;1m"
-        CYAN = "\033[36;1m"
-        GRAY = "\033[37;1m"
-        RESET = "\033[0m"
-    else:
-        RED = ""
-        GREEN = ""
-        YELLOW = ""
-        BLUE = ""
-        PURPLE = ""
-        CYAN = ""
-        GRAY = ""
-        RESET = ""
-
-
-class AttributeDict(dict):
-    def __getattr__(self, attr: str) -> Any:
-        return self[attr]
-
-    def __setattr__(self, attr: str, value: Any) -> None:
-        self[attr] = value
+class _TerminalColorCodesMeta(type):
+    _COLOR_CODES = {
+        "RED": "\033[31;1m",
+        "GREEN": "\033[32;1m",
+        "YELLOW": "\033[33;1m",
+        "BLUE": "\033[34;1m",
+        "PURPLE": "\033[35;1m",
+        "CYAN": "\033[36;1m",
+        "GRAY": "\033[37;1m",
+        "RESET": "\033[0m",
+    }
+    _has_terminal_color = None  # type: Optional[bool]
+
+    def __getattr__(cls, attr: str) -> str:
+        try:
+            color_code = _TerminalColorCodesMeta._COLOR_CODES[attr]
+        except KeyError:
+            raise AttributeError(attr)
+        if _TerminalColorCodesMeta._has_terminal_color is None:
+            _TerminalColorCodesMeta._has_terminal_color = has_terminal_color()
+        return color_code if _TerminalColorCodesMeta._has_terminal_color else ""
+
+
+class TerminalColorCodes(metaclass=_TerminalColorCodesMeta):
+    pass
 
 
 def get_argumentparser() -> argparse.ArgumentParser:
@@ -121,6 +135,25 @@ def get_argumentparser() -> argparse.ArgumentParser:
         default=DEFAULT_USER,
         help="user account for querying the GitLab API (default: %(default)s)",
     )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        action="store",
+        dest="max_workers",
+        type=int,
+        default=DEFAULT_MAX_WORKERS,
+        help="number of parallel delete requests (default: %(default)s)",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        action="store",
+        dest="jobs",
+        type=int,
+        default=1,
+        help="number of concurrent delete requests on the asyncio code path; "
+        "values greater than 1 switch from the thread pool to asyncio (default: %(default)s)",
+    )
     parser.add_argument(
         "-n", "--dry-run", action="store_true", dest="dry_run", help="only print which images would be deleted"
     )
@@ -133,9 +166,9 @@ def get_argumentparser() -> argparse.ArgumentParser:
     return parser
 
 
-def parse_arguments() -> AttributeDict:
+def parse_arguments() -> argparse.Namespace:
     parser = get_argumentparser()
-    args = AttributeDict({key: value for key, value in vars(parser.parse_args()).items()})
+    args = parser.parse_args()
     if not args.print_version and (args.gitlab_server is None or args.registry_server is None):
         if args.gitlab_server is None and args.registry_server is None:
             raise MissingServerNameError("Neither a GitLab server nor a registry server is given.")
@@ -145,35 +178,43 @@ def parse_arguments() -> AttributeDict:
             raise MissingServerNameError("No registry server is given.")
     if not args.print_version:
         for server in ("gitlab_server", "registry_server"):
-            match_obj = re.match(r"([a-zA-Z]+://)?(.+)/?", args[server])
+            match_obj = SERVER_NAME_REGEX.match(getattr(args, server))
             if match_obj:
                 protocol = match_obj.group(1)
                 if protocol is None:
                     protocol = "https"
                 else:
                     protocol = protocol[:-3].lower()  # discard "://"
-                args[server + "_protocol"] = protocol
-                args[server] = match_obj.group(2)
+                setattr(args, server + "_protocol", protocol)
+                setattr(args, server, match_obj.group(2))
             else:
-                raise InvalidServerNameError("{} is not a valid server name.".format(args[server]))
-            if args[server + "_protocol"] not in ("http", "https"):
-                raise UnsupportedProtocolError('The protocol "{}" is not supported.'.format(args[server + "_protocol"]))
-            if args[server + "_protocol"] == "http" and not args.insecure:
+                raise InvalidServerNameError("{} is not a valid server name.".format(getattr(args, server)))
+            if getattr(args, server + "_protocol") not in ("http", "https"):
+                raise UnsupportedProtocolError(
+                    'The protocol "{}" is not supported.'.format(getattr(args, server + "_protocol"))
+                )
+            if getattr(args, server + "_protocol") == "http" and not args.insecure:
                 raise PlainHttpNotAllowedError(
                     'Plain http is not allowed by default. Use the "-k" switch to allow insecure connections.'
                 )
         if args.credentials_file is not None:
             try:
                 with open(args.credentials_file, "r") as f:
-                    for key in ("username", "password"):
-                        args[key] = f.readline().strip()
+                    credential_lines = f.read().splitlines()
             except IOError:
                 raise CredentialsReadError('Could not read credentials file "{}".'.format(args.credentials_file))
+            if len(credential_lines) < 2:
+                raise CredentialsReadError(
+                    'The credentials file "{}" must contain a username and a password on two separate lines.'.format(
+                        args.credentials_file
+                    )
+                )
+            args.username, args.password = (line.strip() for line in credential_lines[:2])
         elif args.username is not None:
             if sys.stdin.isatty():
-                args["password"] = getpass.getpass()
+                args.password = getpass.getpass()
             else:
-                args["password"] = sys.stdin.readline().rstrip()
+                args.password = sys.stdin.readline().rstrip()
         else:
             raise CredentialsReadError("Could not get credentials for the GitLab web api.")
 
@@ -189,69 +230,53 @@ def cleanup_gitlab_registry(
     username: str,
     password: str,
     dry_run: bool,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    jobs: int = 1,
 ) -> None:
     gitlab_base_url = "{}://{}/".format(gitlab_server_protocol, gitlab_server)
     registry_base_url = "{}://{}/".format(registry_server_protocol, registry_server)
 
-    def console_output(repository: str, image_hash: str, successful: bool) -> None:
-        if not dry_run:
-            if successful:
-                print(
-                    "Deleted image {}{}{} in repository {}{}{}.".format(
-                        TerminalColorCodes.BLUE,
-                        image_hash,
-                        TerminalColorCodes.RESET,
-                        TerminalColorCodes.CYAN,
-                        repository,
-                        TerminalColorCodes.RESET,
-                    )
-                )
-            else:
-                print(
-                    "Could not delete image {}{}{} in repository {}{}{}.".format(
-                        TerminalColorCodes.BLUE,
-                        image_hash,
-                        TerminalColorCodes.RESET,
-                        TerminalColorCodes.CYAN,
-                        repository,
-                        TerminalColorCodes.RESET,
-                    )
-                )
-        else:
-            if successful:
-                print(
-                    "Would delete image {}{}{} in repository {}{}{}.".format(
-                        TerminalColorCodes.BLUE,
-                        image_hash,
-                        TerminalColorCodes.RESET,
-                        TerminalColorCodes.CYAN,
-                        repository,
-                        TerminalColorCodes.RESET,
-                    )
-                )
-            else:
-                print(
-                    "Would delete image {}{}{} in repository {}{}{} {}but without success{}.".format(
-                        TerminalColorCodes.BLUE,
-                        image_hash,
-                        TerminalColorCodes.RESET,
-                        TerminalColorCodes.CYAN,
-                        repository,
-                        TerminalColorCodes.RESET,
-                        TerminalColorCodes.RED,
-                        TerminalColorCodes.RESET,
-                    )
-                )
+    # Substitute the color codes once up front; only the image hash and repository
+    # placeholders are left for the per-image format call
+    console_output_messages = {
+        key: template.format(
+            blue=TerminalColorCodes.BLUE,
+            cyan=TerminalColorCodes.CYAN,
+            red=TerminalColorCodes.RED,
+            reset=TerminalColorCodes.RESET,
+            image_hash="{image_hash}",
+            repository="{repository}",
+        )
+        for key, template in CONSOLE_OUTPUT_MESSAGE_TEMPLATES.items()
+    }
 
-    soft_delete_untagged_imagehashes(
-        gitlab_base_url,
-        registry_base_url,
-        username,
-        password,
-        local_registry_root,
-        dry_run=dry_run,
-        notify_callback=console_output,
-    )
+    def console_output(repository: str, image_hash: str, successful: bool) -> None:
+        print(console_output_messages[(dry_run, successful)].format(image_hash=image_hash, repository=repository))
+
+    if jobs > 1:
+        asyncio.run(
+            soft_delete_untagged_imagehashes_async(
+                gitlab_base_url,
+                registry_base_url,
+                username,
+                password,
+                local_registry_root,
+                dry_run=dry_run,
+                notify_callback=console_output,
+                concurrency=jobs,
+            )
+        )
+    else:
+        soft_delete_untagged_imagehashes(
+            gitlab_base_url,
+            registry_base_url,
+            username,
+            password,
+            local_registry_root,
+            dry_run=dry_run,
+            notify_callback=console_output,
+            max_workers=max_workers,
+        )
 
 
 def main() -> None:
@@ -276,6 +301,8 @@ def main() -> None:
                 args.username,
                 args.password,
                 args.dry_run,
+                args.max_workers,
+                args.jobs,
             )
     except expected_exceptions as e:
         print("{}error{}: {}".format(TerminalColorCodes.RED, TerminalColorCodes.RESET, str(e)), file=sys.stderr)
@@ -1,134 +1,433 @@
 import os
-from typing import Dict, List, Optional  # noqa: F401 pylint: disable=unused-import
+import queue
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple  # noqa: F401 pylint: disable=unused-import
+
+try:
+    import liburing
+except ImportError:
+    liburing = None
 
 DEFAULT_REGISTRY_ROOT = "/var/opt/gitlab/gitlab-rails/shared/registry"
+SCAN_WORKER_COUNT = 16
+LINK_READ_WORKER_COUNT = 64
+LINK_READ_SERIAL_THRESHOLD = 32
+IO_URING_QUEUE_DEPTH = 256
+IO_URING_MINIMUM_KERNEL_VERSION = (5, 6)
+# IORING_SETUP_SQPOLL works with unregistered files since kernel 5.11; the task-run
+# optimization flags (SINGLE_ISSUER, COOP_TASKRUN, DEFER_TASKRUN) need kernel 6.1 for
+# DEFER_TASKRUN and are mutually exclusive with SQPOLL
+IO_URING_SQPOLL_KERNEL_VERSION = (5, 11)
+IO_URING_TASKRUN_KERNEL_VERSION = (6, 1)
+IO_URING_SQPOLL_IDLE_MILLISECONDS = 2000
+LINK_FILE_BUFFER_SIZE = 128
 RELATIVE_REPOSITORIES_ROOT = "docker/registry/v2/repositories"
 MANIFESTS_DIRECTORY = "_manifests"
 REVISIONS_DIRECTORY = "_manifests/revisions/sha256"
 TAGS_DIRECTORY = "_manifests/tags"
 TAG_CURRENT_DIRECTORY = "current"
 LINK_FILENAME = "link"
+# Path tails relative to the per-repository directory fds, precomputed so the hot loops
+# only concatenate one directory entry name per link file
+REVISION_LINK_FILE_SUFFIX = "/" + LINK_FILENAME
+TAG_LINK_FILE_SUFFIX = "/" + TAG_CURRENT_DIRECTORY + "/" + LINK_FILENAME
+# Bytes variants for the traversal itself, sparing the filesystem encoding of every
+# directory path passed to scandir/open; decoded back to str at the API boundary
+MANIFESTS_DIRECTORY_BYTES = os.fsencode(MANIFESTS_DIRECTORY)
+REVISIONS_DIRECTORY_BYTES = os.fsencode(REVISIONS_DIRECTORY)
+TAGS_DIRECTORY_BYTES = os.fsencode(TAGS_DIRECTORY)
+
+
+def _decode_link_file_content(data: bytes) -> str:
+    content = data.decode("ascii")
+    newline_index = content.find("\n")
+    if newline_index >= 0:
+        content = content[: newline_index + 1]
+    return content
+
+
+def _read_link_file(link_file_spec: Tuple[Optional[int], str]) -> Optional[str]:
+    dir_fd, link_file_path = link_file_spec
+    try:
+        fd = os.open(link_file_path, os.O_RDONLY, dir_fd=dir_fd)
+        try:
+            data = os.read(fd, LINK_FILE_BUFFER_SIZE)
+        finally:
+            os.close(fd)
+        return _decode_link_file_content(data)
+    except (OSError, UnicodeDecodeError):
+        # Treat corrupt link files (non-ascii content) like unreadable ones
+        return None
+
+
+def _kernel_version() -> Optional[Tuple[int, ...]]:
+    try:
+        return tuple(int(component) for component in os.uname().release.split("-")[0].split(".")[:2])
+    except ValueError:
+        return None
+
+
+_io_uring_support = None  # type: Optional[bool]
+
+
+def _probe_io_uring_support() -> bool:
+    if liburing is None or sys.platform != "linux":
+        return False
+    kernel_version = _kernel_version()
+    if kernel_version is None or kernel_version < IO_URING_MINIMUM_KERNEL_VERSION:
+        return False
+    # io_uring can be compiled into the kernel but still unavailable (io_uring_disabled
+    # sysctl, container seccomp profiles), in which case ring creation fails with
+    # EPERM/ENOSYS; probe an actual ring so such systems use the thread pool instead
+    try:
+        ring = liburing.io_uring()
+        liburing.io_uring_queue_init(8, ring, 0)
+        liburing.io_uring_queue_exit(ring)
+    except OSError:
+        return False
+    return True
+
+
+def _has_io_uring_support() -> bool:
+    global _io_uring_support
+    if _io_uring_support is None:
+        _io_uring_support = _probe_io_uring_support()
+    return _io_uring_support
+
+
+def _init_io_uring_queue(ring: "liburing.io_uring") -> bool:
+    kernel_version = _kernel_version()
+    if kernel_version is not None and kernel_version >= IO_URING_TASKRUN_KERNEL_VERSION:
+        # The kernel rejects combining SQPOLL with the task-run flags, so pick one mode:
+        # cheap completion-side task running on new kernels, SQPOLL on older ones
+        params = liburing.io_uring_params(
+            flags=(
+                liburing.IORING_SETUP_SINGLE_ISSUER
+                | liburing.IORING_SETUP_COOP_TASKRUN
+                | liburing.IORING_SETUP_DEFER_TASKRUN
+            )
+        )
+        try:
+            liburing.io_uring_queue_init_params(IO_URING_QUEUE_DEPTH, ring, params)
+            return True
+        except OSError:
+            pass
+    elif kernel_version is not None and kernel_version >= IO_URING_SQPOLL_KERNEL_VERSION:
+        params = liburing.io_uring_params(
+            flags=liburing.IORING_SETUP_SQPOLL, sq_thread_idle=IO_URING_SQPOLL_IDLE_MILLISECONDS
+        )
+        try:
+            liburing.io_uring_queue_init_params(IO_URING_QUEUE_DEPTH, ring, params)
+            return True
+        except OSError:
+            # SQPOLL needs CAP_SYS_NICE on some configurations -> retry without extra flags
+            pass
+    try:
+        liburing.io_uring_queue_init(IO_URING_QUEUE_DEPTH, ring, 0)
+    except OSError:
+        # A full-depth ring can still fail where the small support probe succeeded, e.g.
+        # RLIMIT_MEMLOCK accounting on kernels < 5.12 -> callers degrade to the thread pool
+        return False
+    return True
+
+
+def _read_link_files_io_uring(
+    ring: "liburing.io_uring", cqes: "liburing.io_uring_cqes", link_file_specs: List[Tuple[Optional[int], str]]
+) -> List[Optional[str]]:
+    link_file_contents = [None] * len(link_file_specs)  # type: List[Optional[str]]
+    for batch_start_index in range(0, len(link_file_specs), IO_URING_QUEUE_DEPTH):
+        batch_specs = link_file_specs[batch_start_index : batch_start_index + IO_URING_QUEUE_DEPTH]
+        fds = []  # type: List[int]
+        buffers = []  # type: List[bytearray]
+        iovecs = []  # type: List[object]
+        content_indices = []  # type: List[int]
+        try:
+            for spec_index, (dir_fd, link_file_path) in enumerate(batch_specs):
+                try:
+                    fd = os.open(link_file_path, os.O_RDONLY, dir_fd=dir_fd)
+                except OSError:
+                    continue
+                buffer = bytearray(LINK_FILE_BUFFER_SIZE)
+                iovec = liburing.iovec(buffer)
+                sqe = liburing.io_uring_get_sqe(ring)
+                liburing.io_uring_prep_readv(sqe, fd, iovec, 1, 0)
+                sqe.user_data = len(fds)
+                fds.append(fd)
+                buffers.append(buffer)
+                iovecs.append(iovec)
+                content_indices.append(batch_start_index + spec_index)
+            if not fds:
+                continue
+            liburing.io_uring_submit_and_wait(ring, len(fds))
+            for _ in range(len(fds)):
+                liburing.io_uring_wait_cqe(ring, cqes)
+                cqe = cqes[0]
+                buffer_index = cqe.user_data
+                if cqe.res > 0:
+                    try:
+                        link_file_contents[content_indices[buffer_index]] = _decode_link_file_content(
+                            bytes(buffers[buffer_index][: cqe.res])
+                        )
+                    except UnicodeDecodeError:
+                        # Treat corrupt link files (non-ascii content) like unreadable ones
+                        pass
+                liburing.io_uring_cqe_seen(ring, cqe)
+        finally:
+            for fd in fds:
+                os.close(fd)
+    return link_file_contents
+
+
+_link_read_executor = None  # type: Optional[ThreadPoolExecutor]
+_link_read_executor_lock = threading.Lock()
+
+
+def _get_link_read_executor() -> ThreadPoolExecutor:
+    # One process-lifetime executor shared by all scan workers; spinning up a fresh
+    # 64-thread pool per repository batch would dwarf the read latency being hidden
+    global _link_read_executor
+    with _link_read_executor_lock:
+        if _link_read_executor is None:
+            _link_read_executor = ThreadPoolExecutor(max_workers=LINK_READ_WORKER_COUNT)
+        return _link_read_executor
+
+
+class _LinkFileReader:
+    # One instance (and thus at most one io_uring ring) per scan worker, reused for all
+    # repositories the worker processes
+    def __init__(self) -> None:
+        self._ring = None
+        self._cqes = None
+        if _has_io_uring_support():
+            ring = liburing.io_uring()
+            if _init_io_uring_queue(ring):
+                self._ring = ring
+                self._cqes = liburing.io_uring_cqes()
+
+    def read(self, link_file_specs: List[Tuple[Optional[int], str]]) -> List[Optional[str]]:
+        if self._ring is not None:
+            return _read_link_files_io_uring(self._ring, self._cqes, link_file_specs)
+        if len(link_file_specs) < LINK_READ_SERIAL_THRESHOLD:
+            # Small batches are cheaper to read directly on the calling worker thread
+            return [_read_link_file(link_file_spec) for link_file_spec in link_file_specs]
+        return list(_get_link_read_executor().map(_read_link_file, link_file_specs))
+
+    def close(self) -> None:
+        if self._ring is not None:
+            liburing.io_uring_queue_exit(self._ring)
+            self._ring = None
 
 
 class LocalRegistry:
     def __init__(
         self, registry_root: str = DEFAULT_REGISTRY_ROOT, relative_repositories_root: str = RELATIVE_REPOSITORIES_ROOT
     ) -> None:
-        self._docker_repositories_root = os.path.join(registry_root, relative_repositories_root)
+        self._docker_repositories_root = os.fsencode(os.path.join(registry_root, relative_repositories_root))
         self._repository_paths = None  # type: Optional[List[str]]
         self._repository_imagehashes = None  # type: Optional[Dict[str, List[str]]]
         self._repository_tags = None  # type: Optional[Dict[str, List[str]]]
         self._repository_tagged_imagehashes = None  # type: Optional[Dict[str, List[str]]]
         self._repository_untagged_imagehashes = None  # type: Optional[Dict[str, List[str]]]
 
-    def _find_all_repository_paths(self) -> List[str]:
-        def on_error(error: OSError) -> None:
-            raise error
-
-        repository_paths = [
-            os.path.relpath(root, self._docker_repositories_root)
-            for root, directories, files in os.walk(self._docker_repositories_root, onerror=on_error)
-            if os.path.isdir(os.path.join(root, MANIFESTS_DIRECTORY))
-        ]
-        return repository_paths
-
-    def _find_repository_imagehashes(self) -> Dict[str, List[str]]:
-        repository_imagehashes = {}  # type: Dict[str, List[str]]
-        for repository_path in self.repository_paths:
-            imagehashes = []  # type: List[str]
+    def _scan_repository(
+        self, repository_directory_path: bytes
+    ) -> Tuple[List[Tuple[Optional[int], str]], List[str], List[Tuple[Optional[int], str]], List[int]]:
+        # Open the revisions and tags directories once per repository and address all link
+        # files relative to these fds, so the kernel does not re-walk the long path prefix
+        # for every single open
+        open_dir_fds = []  # type: List[int]
+        revision_link_file_specs = []  # type: List[Tuple[Optional[int], str]]
+        try:
+            revisions_dir_fd = os.open(
+                os.path.join(repository_directory_path, REVISIONS_DIRECTORY_BYTES), os.O_RDONLY | os.O_DIRECTORY
+            )
+            open_dir_fds.append(revisions_dir_fd)
+            with os.scandir(revisions_dir_fd) as revision_iterator:
+                for entry in revision_iterator:
+                    revision_link_file_specs.append((revisions_dir_fd, entry.name + REVISION_LINK_FILE_SUFFIX))
+        except OSError:
+            pass
+        tag_link_file_specs = []  # type: List[Tuple[Optional[int], str]]
+        try:
+            tags_dir_fd = os.open(
+                os.path.join(repository_directory_path, TAGS_DIRECTORY_BYTES), os.O_RDONLY | os.O_DIRECTORY
+            )
+            open_dir_fds.append(tags_dir_fd)
+            tags = os.listdir(tags_dir_fd)
+            tag_link_file_specs = [(tags_dir_fd, tag + TAG_LINK_FILE_SUFFIX) for tag in tags]
+        except OSError:
+            tags = []
+        return revision_link_file_specs, tags, tag_link_file_specs, open_dir_fds
+
+    def _iter_scanned_repositories(self) -> Iterator[Tuple[str, List[str], List[str], List[str]]]:
+        scan_errors = []  # type: List[Exception]
+        pending_directory_paths = queue.Queue()  # type: queue.Queue
+        scanned_repositories = queue.Queue()  # type: queue.Queue
+        pending_directory_paths.put(self._docker_repositories_root)
+
+        def scan_directories() -> None:
+            # A worker must never exit while the queue is non-empty: the queue join in
+            # finish_scan would block forever. Failures are collected in scan_errors and
+            # the worker keeps draining (without a reader, directories are only drained,
+            # not processed, so the scan aborts quickly and raises at the end).
+            link_file_reader = None  # type: Optional[_LinkFileReader]
             try:
-                for image_hash in os.listdir(
-                    os.path.join(self._docker_repositories_root, repository_path, REVISIONS_DIRECTORY)
-                ):
-                    try:
-                        with open(
-                            os.path.join(
-                                self._docker_repositories_root,
-                                repository_path,
-                                REVISIONS_DIRECTORY,
-                                image_hash,
-                                LINK_FILENAME,
-                            ),
-                            "r",
-                        ) as f:
-                            image = f.readline()
-                        imagehashes.append(image)
-                    except OSError:
-                        pass
-            except OSError:
-                pass
-            repository_imagehashes[repository_path] = imagehashes
-        return repository_imagehashes
-
-    def _find_repository_tags(self) -> Dict[str, List[str]]:
-        repository_tags = {}  # type: Dict[str, List[str]]
-        for repository_path in self.repository_paths:
+                link_file_reader = _LinkFileReader()
+            except Exception as e:  # pylint: disable=broad-except
+                scan_errors.append(e)
             try:
-                tags = os.listdir(os.path.join(self._docker_repositories_root, repository_path, TAGS_DIRECTORY))
-            except OSError:
-                tags = []
-            repository_tags[repository_path] = tags
-        return repository_tags
-
-    def _find_repository_tagged_imagehashes(self) -> Dict[str, List[str]]:
-        repository_tagged_imagehashes = {}  # type: Dict[str, List[str]]
-        for repository_path in self.repository_paths:
-            tagged_imagehashes = []  # type: List[str]
-            for tag in self.repository_tags[repository_path]:
+                scan_directories_with_reader(link_file_reader)
+            finally:
+                if link_file_reader is not None:
+                    link_file_reader.close()
+
+        def scan_directories_with_reader(link_file_reader: Optional[_LinkFileReader]) -> None:
+            while True:
+                directory_path = pending_directory_paths.get()
+                if directory_path is None:
+                    break
                 try:
-                    with open(
-                        os.path.join(
-                            self._docker_repositories_root,
-                            repository_path,
-                            TAGS_DIRECTORY,
-                            tag,
-                            TAG_CURRENT_DIRECTORY,
-                            LINK_FILENAME,
-                        )
-                    ) as f:
-                        tagged_imagehash = f.readline()
-                    tagged_imagehashes.append(tagged_imagehash)
-                except OSError:
-                    pass
-            repository_tagged_imagehashes[repository_path] = tagged_imagehashes
-        return repository_tagged_imagehashes
-
-    def _find_repository_untagged_imagehashes(self) -> Dict[str, List[str]]:
-        repository_untagged_imagehashes = {
-            repository_path: list(
-                set(self.repository_imagehashes[repository_path])
-                - set(self.repository_tagged_imagehashes[repository_path])
+                    if link_file_reader is None:
+                        continue
+                    is_repository_path = False
+                    subdirectory_paths = []  # type: List[bytes]
+                    try:
+                        with os.scandir(directory_path) as directory_iterator:
+                            for entry in directory_iterator:
+                                if not entry.is_dir(follow_symlinks=False):
+                                    continue
+                                if entry.name == MANIFESTS_DIRECTORY_BYTES:
+                                    # Prune only the manifest subtree itself; repositories can
+                                    # nest (e.g. group/project and group/project/feature), so
+                                    # the other subdirectories must still be visited
+                                    is_repository_path = True
+                                else:
+                                    subdirectory_paths.append(entry.path)
+                    except OSError as e:
+                        scan_errors.append(e)
+                        continue
+                    if is_repository_path:
+                        # Funnel errors into scan_errors like the scandir call above; an
+                        # escaping exception would kill the worker and leave the queue
+                        # join in finish_scan waiting forever
+                        try:
+                            repository_path = os.fsdecode(
+                                os.path.relpath(directory_path, self._docker_repositories_root)
+                            )
+                            (
+                                revision_link_file_specs,
+                                tags,
+                                tag_link_file_specs,
+                                repository_dir_fds,
+                            ) = self._scan_repository(directory_path)
+                            try:
+                                link_file_contents = link_file_reader.read(
+                                    revision_link_file_specs + tag_link_file_specs
+                                )
+                            finally:
+                                for dir_fd in repository_dir_fds:
+                                    os.close(dir_fd)
+                            imagehashes = [
+                                image
+                                for image in link_file_contents[: len(revision_link_file_specs)]
+                                if image is not None
+                            ]
+                            tagged_imagehashes = [
+                                tagged_imagehash
+                                for tagged_imagehash in link_file_contents[len(revision_link_file_specs) :]
+                                if tagged_imagehash is not None
+                            ]
+                            scanned_repositories.put((repository_path, imagehashes, tags, tagged_imagehashes))
+                        except OSError as e:
+                            scan_errors.append(e)
+                    for subdirectory_path in subdirectory_paths:
+                        pending_directory_paths.put(subdirectory_path)
+                except Exception as e:  # pylint: disable=broad-except
+                    scan_errors.append(e)
+                finally:
+                    pending_directory_paths.task_done()
+
+        def finish_scan() -> None:
+            pending_directory_paths.join()
+            for _ in scan_workers:
+                pending_directory_paths.put(None)
+            for scan_worker in scan_workers:
+                scan_worker.join()
+            scanned_repositories.put(None)
+
+        scan_workers = [threading.Thread(target=scan_directories) for _ in range(SCAN_WORKER_COUNT)]
+        for scan_worker in scan_workers:
+            scan_worker.start()
+        finish_scan_thread = threading.Thread(target=finish_scan)
+        finish_scan_thread.start()
+        try:
+            while True:
+                scanned_repository = scanned_repositories.get()
+                if scanned_repository is None:
+                    break
+                yield scanned_repository
+        finally:
+            finish_scan_thread.join()
+        if scan_errors:
+            raise scan_errors[0]
+
+    @staticmethod
+    def _compute_untagged_imagehashes(imagehashes: List[str], tagged_imagehashes: List[str]) -> List[str]:
+        tagged_or_seen_imagehashes = set(tagged_imagehashes)
+        untagged_imagehashes = []  # type: List[str]
+        for imagehash in imagehashes:
+            if imagehash not in tagged_or_seen_imagehashes:
+                untagged_imagehashes.append(imagehash)
+                tagged_or_seen_imagehashes.add(imagehash)
+        return untagged_imagehashes
+
+    def iter_untagged(self) -> Iterator[Tuple[str, List[str]]]:
+        for repository_path, imagehashes, _, tagged_imagehashes in self._iter_scanned_repositories():
+            yield repository_path, self._compute_untagged_imagehashes(imagehashes, tagged_imagehashes)
+
+    def _scan_all(self) -> None:
+        self._repository_paths = []
+        self._repository_imagehashes = {}
+        self._repository_tags = {}
+        self._repository_tagged_imagehashes = {}
+        self._repository_untagged_imagehashes = {}
+        for repository_path, imagehashes, tags, tagged_imagehashes in self._iter_scanned_repositories():
+            self._repository_paths.append(repository_path)
+            self._repository_imagehashes[repository_path] = imagehashes
+            self._repository_tags[repository_path] = tags
+            self._repository_tagged_imagehashes[repository_path] = tagged_imagehashes
+            self._repository_untagged_imagehashes[repository_path] = self._compute_untagged_imagehashes(
+                imagehashes, tagged_imagehashes
             )
-            for repository_path in self.repository_paths
-        }
-        return repository_untagged_imagehashes
 
     @property
     def repository_paths(self) -> List[str]:
         if self._repository_paths is None:
-            self._repository_paths = self._find_all_repository_paths()
+            self._scan_all()
         return self._repository_paths
 
     @property
     def repository_imagehashes(self) -> Dict[str, List[str]]:
         if self._repository_imagehashes is None:
-            self._repository_imagehashes = self._find_repository_imagehashes()
+            self._scan_all()
         return self._repository_imagehashes
 
     @property
     def repository_tags(self) -> Dict[str, List[str]]:
         if self._repository_tags is None:
-            self._repository_tags = self._find_repository_tags()
+            self._scan_all()
         return self._repository_tags
 
     @property
     def repository_tagged_imagehashes(self) -> Dict[str, List[str]]:
         if self._repository_tagged_imagehashes is None:
-            self._repository_tagged_imagehashes = self._find_repository_tagged_imagehashes()
+            self._scan_all()
         return self._repository_tagged_imagehashes
 
     @property
     def repository_untagged_imagehashes(self) -> Dict[str, List[str]]:
         if self._repository_untagged_imagehashes is None:
-            self._repository_untagged_imagehashes = self._find_repository_untagged_imagehashes()
+            self._scan_all()
         return self._repository_untagged_imagehashes
@@ -48,8 +48,12 @@ setup(
     name="gitlab-registry-cleanup",
     version=version,
     packages=find_packages(),
-    python_requires="~=3.3",
+    python_requires=">=3.7",
     install_requires=install_requires,
+    # The liburing bindings changed their Python API incompatibly with the 2023.x
+    # releases; the reader depends on the 0.0.x API (io_uring_cqes, iovec(buffer),
+    # sqe.user_data assignment)
+    extras_require={"io_uring": ["liburing>=0.0.6,<2023"]},
     entry_points={"console_scripts": ["gitlab-registry-cleanup = gitlab_registry_cleanup.cli:main"]},
     author="Ingo Heimbach",
     author_email="i.heimbach@fz-juelich.de",
@@ -64,10 +68,11 @@ setup(
         "Intended Audience :: System Administrators",
         "License :: OSI Approved :: MIT License",
         "Programming Language :: Python :: 3",
-        "Programming Language :: Python :: 3.3",
-        "Programming Language :: Python :: 3.4",
-        "Programming Language :: Python :: 3.5",
-        "Programming Language :: Python :: 3.6",
+        "Programming Language :: Python :: 3.7",
+        "Programming Language :: Python :: 3.8",
+        "Programming Language :: Python :: 3.9",
+        "Programming Language :: Python :: 3.10",
+        "Programming Language :: Python :: 3.11",
         "Programming Language :: Python :: 3 :: Only",
         "Topic :: System :: Systems Administration",
     ],